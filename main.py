@@ -1,63 +1,399 @@
 import os
-from fastapi import FastAPI, HTTPException
+import asyncio
+import functools
+import hashlib
+import ipaddress
+import socket
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from pydantic import BaseModel, HttpUrl
-import requests
-from typing import Optional, Dict, Any
+from starlette.background import BackgroundTask
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.types import ASGIApp, Receive, Scope, Send
+import httpx
+import orjson
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import ServerSelectionTimeoutError
+import redis.asyncio as aioredis
+from redis.exceptions import RedisError
+from typing import Optional, Dict, Any, Awaitable, Callable, List, Tuple
 
-app = FastAPI()
+# Load environment variables from .env file
+load_dotenv()
+
+try:
+    import yt_dlp  # type: ignore
+    _yt_dlp_import_error: Optional[Exception] = None
+except Exception as e:
+    yt_dlp = None
+    _yt_dlp_import_error = e
+
+TIKWM_URL = "https://www.tikwm.com/api/"
+TIKWM_WARMUP_URL = "https://www.tikwm.com/"
+TIKWM_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36",
+    "Referer": "https://www.tikwm.com/",
+    "Origin": "https://www.tikwm.com",
+}
+
+YDL_OPTS: Dict[str, Any] = {
+    "quiet": True,
+    "no_warnings": True,
+    "format": "bv*+ba/b[ext=mp4]/b/bestaudio/best",
+    "noplaylist": True,
+    "skip_download": True,
+    "cachedir": False,
+    "http_chunk_size": 10485760,  # 10MB chunks can help some CDNs
+}
+
+# At most this many yt-dlp extractions run at once per worker; requests that
+# can't get a slot within YDL_QUEUE_TIMEOUT seconds get a 503 instead of
+# piling up behind slow sites and starving the threadpool.
+YDL_CONCURRENCY = int(os.getenv("YDL_CONCURRENCY", "8"))
+YDL_QUEUE_TIMEOUT = 5
+
+# Resolver results are cached in Redis (when REDIS_URL is set) for these many seconds.
+TIKTOK_CACHE_TTL = 600
+RESOLVE_CACHE_TTL = 1800
+# Redis is only a cache, so give up on it quickly and call upstream instead of
+# stalling on a hung or unreachable server.
+REDIS_SOCKET_TIMEOUT = 0.5
+# Permanent failures (see PermanentResolveError) are cached briefly to absorb retries.
+ERROR_CACHE_TTL = 60
+# Cross-worker de-duplication: how long a worker may hold the per-URL lock, and
+# how often the others check the cache while waiting for it.
+INFLIGHT_LOCK_TTL = 30
+INFLIGHT_POLL_INTERVAL = 0.1
+# /api/proxy relays media in chunks of this size and only passes these headers
+# through, so range requests (video seeking) keep working.
+PROXY_CHUNK_SIZE = 1 << 20
+PROXY_REQUEST_HEADERS = ("range",)
+PROXY_RESPONSE_HEADERS = (
+    "content-type",
+    "content-length",
+    "content-range",
+    "content-encoding",
+    "accept-ranges",
+    "etag",
+    "last-modified",
+)
+# /api/proxy only fetches from these hosts (and their subdomains): the CDNs
+# that tikwm and yt-dlp hand out as download_url. Override with a
+# comma-separated PROXY_ALLOWED_HOSTS. Redirects are followed by hand so each
+# hop is checked against the same rules.
+PROXY_ALLOWED_HOSTS = tuple(
+    h.strip().lower()
+    for h in os.getenv(
+        "PROXY_ALLOWED_HOSTS",
+        "tikwm.com,tiktokcdn.com,tiktokcdn-us.com,tiktokv.com,byteoversea.com,"
+        "googlevideo.com,ytimg.com,cdninstagram.com,fbcdn.net,xhscdn.com",
+    ).split(",")
+    if h.strip()
+)
+PROXY_MAX_REDIRECTS = 5
+# Media streams get their own connection pool so slow downloads can't starve
+# the resolver client. Reads may stall between chunks on slow CDNs.
+PROXY_LIMITS = httpx.Limits(max_keepalive_connections=20, max_connections=100)
+PROXY_TIMEOUT = httpx.Timeout(connect=10, read=60, write=10, pool=5)
+# /test reuses its last database check for this many seconds so health-check
+# probes don't each cost a Mongo round-trip.
+TEST_CACHE_TTL = 3
+
+
+async def _warm_tikwm(client: httpx.AsyncClient) -> None:
+    """Open a connection to tikwm so the first real request skips the TLS handshake."""
+    try:
+        await client.head(TIKWM_WARMUP_URL, headers=TIKWM_HEADERS, timeout=5)
+    except httpx.HTTPError:
+        pass
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One shared async client so upstream calls reuse pooled connections
+    # instead of blocking a threadpool worker per request.
+    app.state.http = httpx.AsyncClient(
+        timeout=20,
+        # Limits and HTTP/2 live on the transport once one is supplied; retries
+        # only cover connection setup failures, so a dropped keep-alive socket is
+        # redialled. HTTP/2 lets concurrent tikwm calls share one TLS connection.
+        transport=httpx.AsyncHTTPTransport(
+            http2=True,
+            retries=2,
+            limits=httpx.Limits(max_keepalive_connections=50, max_connections=200),
+        ),
+    )
+    app.state.proxy_http = httpx.AsyncClient(timeout=PROXY_TIMEOUT, limits=PROXY_LIMITS)
+    # Open the database client up front so it exists before the first request
+    # instead of being created lazily inside /test. Motor keeps Mongo calls off
+    # the event loop; the sync helpers in database.py keep their own PyMongo
+    # client and are only loaded by code that imports them.
+    app.state.db = None
+    app.state.db_error = None
+    mongo = None
+    database_url = os.getenv("DATABASE_URL")
+    database_name = os.getenv("DATABASE_NAME")
+    if database_url and database_name:
+        try:
+            mongo = AsyncIOMotorClient(database_url)
+            app.state.db = mongo[database_name]
+        except Exception as e:
+            app.state.db_error = e
+
+    redis_url = os.getenv("REDIS_URL")
+    app.state.redis = (
+        aioredis.Redis.from_url(
+            redis_url,
+            socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+            socket_timeout=REDIS_SOCKET_TIMEOUT,
+        )
+        if redis_url
+        else None
+    )
+    # Warm up in the background so an unreachable tikwm doesn't delay startup.
+    warmup = asyncio.create_task(_warm_tikwm(app.state.http))
+    try:
+        yield
+    finally:
+        warmup.cancel()
+        await app.state.http.aclose()
+        await app.state.proxy_http.aclose()
+        if app.state.redis is not None:
+            await app.state.redis.aclose()
+        if mongo is not None:
+            mongo.close()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+
+# Comma-separated list of allowed origins; defaults to any origin. Credentials
+# are only allowed with an explicit list, since browsers reject credentialed
+# responses carrying a wildcard origin.
+ALLOWED_ORIGINS = [o.strip() for o in os.getenv("ALLOWED_ORIGINS", "*").split(",") if o.strip()]
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
+    allow_origins=ALLOWED_ORIGINS,
+    allow_credentials="*" not in ALLOWED_ORIGINS,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
 
-class TikTokRequest(BaseModel):
-    url: HttpUrl
+class SelectiveGZipMiddleware(GZipMiddleware):
+    """GZip responses except on paths that relay already-compressed media."""
+
+    def __init__(self, app: ASGIApp, excluded_paths: Tuple[str, ...] = (), **kwargs: Any) -> None:
+        super().__init__(app, **kwargs)
+        self.excluded_paths = excluded_paths
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and scope["path"] in self.excluded_paths:
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
 
 
-class ResolveRequest(BaseModel):
+# Outermost, so CORS headers are set before the body is compressed. /api/proxy
+# carries MP4s and range responses, which gzip would only slow down or break.
+app.add_middleware(SelectiveGZipMiddleware, minimum_size=512, excluded_paths=("/api/proxy",))
+
+
+class UrlRequest(BaseModel):
     url: HttpUrl
 
 
+class PermanentResolveError(HTTPException):
+    """
+    A resolver failure that retrying won't fix (no media in the post, unsupported
+    URL), so it is safe to cache. Anything else, including tikwm's own
+    ``code != 0`` replies which also cover rate limiting, is never cached.
+    """
+
+
+async def _cache_get(key: str) -> Optional[Dict[str, Any]]:
+    try:
+        cached = await app.state.redis.get(key)
+    except RedisError:
+        return None
+    return orjson.loads(cached) if cached is not None else None
+
+
+async def _cache_set(key: str, entry: Dict[str, Any], ttl: int) -> None:
+    try:
+        await app.state.redis.set(key, orjson.dumps(entry), ex=ttl)
+    except RedisError:
+        pass
+
+
+def _unpack(entry: Dict[str, Any]) -> Dict[str, Any]:
+    if "error" in entry:
+        raise HTTPException(**entry["error"])
+    return entry["result"]
+
+
+# Upstream calls currently running in this process, keyed like the cache, so
+# concurrent requests for the same URL share a single tikwm/yt-dlp call. Each
+# runs as its own task so no caller's cancellation can take it down for the rest.
+_inflight: Dict[str, "asyncio.Task[Dict[str, Any]]"] = {}
+
+
+def _forget_inflight(key: str, task: "asyncio.Task[Dict[str, Any]]") -> None:
+    if _inflight.get(key) is task:
+        del _inflight[key]
+    if not task.cancelled():
+        task.exception()  # mark retrieved; every caller may have gone away
+
+
+async def _cached_resolve(
+    prefix: str,
+    url: str,
+    ttl: int,
+    resolver: Callable[[str], Awaitable[Dict[str, Any]]],
+) -> Dict[str, Any]:
+    """
+    Run ``resolver`` for ``url`` through the Redis cache. Redis is best-effort:
+    when it is not configured or unreachable the resolver is simply called.
+    """
+    key = f"{prefix}:{hashlib.sha1(url.encode()).hexdigest()}"
+    if app.state.redis is not None:
+        entry = await _cache_get(key)
+        if entry is not None:
+            return _unpack(entry)
+
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(_resolve_and_store(key, url, ttl, resolver))
+        _inflight[key] = task
+        task.add_done_callback(functools.partial(_forget_inflight, key))
+    # Shield so a disconnecting caller doesn't cancel the shared call.
+    return await asyncio.shield(task)
+
+
+# Deletes the in-flight lock only if it still holds our token, so a worker that
+# overran the TTL can't release a lock another worker has since taken.
+_RELEASE_LOCK_LUA = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+async def _resolve_and_store(
+    key: str,
+    url: str,
+    ttl: int,
+    resolver: Callable[[str], Awaitable[Dict[str, Any]]],
+) -> Dict[str, Any]:
+    redis = app.state.redis
+    if redis is None:
+        return await resolver(url)
+
+    # Other workers coordinate through a short-lived lock: whoever takes it
+    # calls upstream, the rest poll the cache until the result lands. If the
+    # holder gives up without caching anything (e.g. a 502), the lock vanishes
+    # with no entry and a waiter takes it over instead of sitting out the TTL.
+    lock_key = f"{key}:lock"
+    token = uuid.uuid4().hex
+    try:
+        locked = await redis.set(lock_key, token, nx=True, ex=INFLIGHT_LOCK_TTL)
+    except RedisError:
+        locked = True
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + INFLIGHT_LOCK_TTL
+    while not locked and loop.time() < deadline:
+        await asyncio.sleep(INFLIGHT_POLL_INTERVAL)
+        entry = await _cache_get(key)
+        if entry is not None:
+            return _unpack(entry)
+        try:
+            if not await redis.exists(lock_key):
+                locked = await redis.set(lock_key, token, nx=True, ex=INFLIGHT_LOCK_TTL)
+        except RedisError:
+            break
+
+    try:
+        try:
+            result = await resolver(url)
+        except PermanentResolveError as e:
+            error = {"status_code": e.status_code, "detail": e.detail}
+            await _cache_set(key, {"error": error}, ERROR_CACHE_TTL)
+            raise
+        await _cache_set(key, {"result": result}, ttl)
+        return result
+    finally:
+        if locked:
+            try:
+                await redis.eval(_RELEASE_LOCK_LUA, 1, lock_key, token)
+            except RedisError:
+                pass
+
+
+def _static_json(payload: Dict[str, Any]) -> Tuple[bytes, str]:
+    body = orjson.dumps(payload)
+    return body, f'"{hashlib.md5(body).hexdigest()}"'
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against ``etag`` (RFC 9110 13.1.2)."""
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def _static_response(request: Request, body: bytes, etag: str) -> Response:
+    """Serve a constant JSON body, answering 304 when the client already has it."""
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=60"}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+# Constant responses are serialized once at import time.
+_ROOT_BODY, _ROOT_ETAG = _static_json({"message": "Hello from FastAPI Backend!"})
+_HELLO_BODY, _HELLO_ETAG = _static_json({"message": "Hello from the backend API!"})
+
+
 @app.get("/")
-def read_root():
-    return {"message": "Hello from FastAPI Backend!"}
+async def read_root(request: Request):
+    return _static_response(request, _ROOT_BODY, _ROOT_ETAG)
 
 
 @app.get("/api/hello")
-def hello():
-    return {"message": "Hello from the backend API!"}
+async def hello(request: Request):
+    return _static_response(request, _HELLO_BODY, _HELLO_ETAG)
 
 
 @app.post("/api/tiktok/metadata")
-def tiktok_metadata(payload: TikTokRequest):
+async def tiktok_metadata(payload: UrlRequest):
     """
     Resolve TikTok video metadata and direct no-watermark download URL by calling a
     reliable third-party resolver (tikwm.com). We simply proxy essential data.
     """
+    return await _cached_resolve("tt", str(payload.url), TIKTOK_CACHE_TTL, _resolve_tiktok)
+
+
+async def _resolve_tiktok(url: str) -> Dict[str, Any]:
     try:
-        resp = requests.post(
-            "https://www.tikwm.com/api/",
-            data={"url": str(payload.url)},
-            headers={
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36",
-                "Referer": "https://www.tikwm.com/",
-                "Origin": "https://www.tikwm.com",
-            },
-            timeout=20,
-        )
-    except requests.RequestException as e:
+        resp = await app.state.http.post(TIKWM_URL, data={"url": url}, headers=TIKWM_HEADERS)
+    except httpx.HTTPError as e:
         raise HTTPException(status_code=502, detail=f"Resolver network error: {e}")
 
     if resp.status_code != 200:
         raise HTTPException(status_code=resp.status_code, detail="Resolver error")
 
-    data = resp.json()
+    data = orjson.loads(resp.content)
     if not data or data.get("code") != 0 or not data.get("data"):
         raise HTTPException(status_code=400, detail=data.get("msg", "Failed to resolve video"))
 
@@ -65,10 +401,11 @@ def tiktok_metadata(payload: TikTokRequest):
     # Prefer hdplay (no watermark) if present, fall back to play.
     download_url = d.get("hdplay") or d.get("play")
     if not download_url:
-        raise HTTPException(status_code=404, detail="Download URL not found")
+        raise PermanentResolveError(status_code=404, detail="Download URL not found")
 
     title = d.get("title") or "TikTok Video"
-    cover = d.get("cover") or d.get("origin_cover") or d.get("music_info", {}).get("cover")
+    music_info = d.get("music_info")
+    cover = d.get("cover") or d.get("origin_cover") or (music_info.get("cover") if music_info else None)
 
     return {
         "title": title,
@@ -80,74 +417,76 @@ def tiktok_metadata(payload: TikTokRequest):
 
 
 @app.post("/api/resolve")
-def resolve_generic(payload: ResolveRequest):
+async def resolve_generic(payload: UrlRequest):
     """
     Resolve direct media for popular platforms (YouTube, Instagram, TikTok, RED/Rednote, etc.)
     using yt-dlp without downloading. Returns a normalized response.
     """
+    return await _cached_resolve("ydl", str(payload.url), RESOLVE_CACHE_TTL, _resolve_ytdlp)
+
+
+# YoutubeDL instances are expensive to build (extractor tables, plugins) and
+# not documented as thread-safe, so each threadpool worker keeps its own.
+_ydl_local = threading.local()
+
+
+_ydl_semaphore = asyncio.Semaphore(YDL_CONCURRENCY)
+
+
+def _extract_info(url: str) -> Dict[str, Any]:
+    ydl = getattr(_ydl_local, "ydl", None)
+    if ydl is None:
+        ydl = _ydl_local.ydl = yt_dlp.YoutubeDL(dict(YDL_OPTS))
+    return ydl.extract_info(url, download=False)
+
+
+async def _resolve_ytdlp(url: str) -> Dict[str, Any]:
+    if yt_dlp is None:
+        raise HTTPException(status_code=500, detail=f"yt-dlp not available: {_yt_dlp_import_error}")
+
     try:
-        import yt_dlp  # type: ignore
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"yt-dlp not available: {e}")
-
-    ydl_opts: Dict[str, Any] = {
-        "quiet": True,
-        "no_warnings": True,
-        "format": "bv*+ba/b[ext=mp4]/b/bestaudio/best",
-        "noplaylist": True,
-        "skip_download": True,
-        "cachedir": False,
-        "http_chunk_size": 10485760,  # 10MB chunks can help some CDNs
-    }
+        await asyncio.wait_for(_ydl_semaphore.acquire(), timeout=YDL_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="Resolver busy, try again shortly")
 
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(str(payload.url), download=False)
+        # yt-dlp is blocking; keep it off the event loop.
+        info = await asyncio.to_thread(_extract_info, url)
     except yt_dlp.utils.DownloadError as e:  # type: ignore
-        raise HTTPException(status_code=400, detail=f"Failed to extract: {e}")
+        raise PermanentResolveError(status_code=400, detail=f"Failed to extract: {e}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Unexpected error: {e}")
+    finally:
+        _ydl_semaphore.release()
 
     # If a playlist-like object, pick first entry
     if info.get("_type") == "playlist" and info.get("entries"):
         info = info["entries"][0]
 
     title: str = info.get("title") or "Video"
-    cover: Optional[str] = info.get("thumbnail") or info.get("thumbnails", [{}])[0].get("url")
+    thumbnails = info.get("thumbnails")
+    cover: Optional[str] = info.get("thumbnail") or (thumbnails[0].get("url") if thumbnails else None)
     author: Optional[str] = info.get("uploader") or info.get("channel") or info.get("author")
     duration: Optional[float] = info.get("duration")
 
-    # Determine a streaming URL from requested formats or formats
-    download_url: Optional[str] = None
-    # When format selection picks merged formats, yt-dlp exposes requested_formats
+    # Determine a streaming URL from requested formats or formats. Each step
+    # short-circuits at its first hit instead of scanning the full list.
+    # When format selection picks merged formats, yt-dlp exposes requested_formats;
+    # prefer the video part if available else the first.
     requested_formats = info.get("requested_formats") or []
-    if requested_formats:
-        # Prefer the video part if available else the first
-        for f in requested_formats:
-            if f.get("vcodec") != "none" and f.get("url"):
-                download_url = f.get("url")
-                break
-        if not download_url and requested_formats[0].get("url"):
-            download_url = requested_formats[0].get("url")
-
-    if not download_url:
+    formats = info.get("formats") or []
+    download_url: Optional[str] = (
+        next((f["url"] for f in requested_formats if f.get("vcodec") != "none" and f.get("url")), None)
+        or (requested_formats[0].get("url") if requested_formats else None)
         # Fall back to the best single format url
-        if info.get("url"):
-            download_url = info.get("url")
-        else:
-            formats = info.get("formats") or []
-            # Choose best mp4 if possible otherwise last format
-            best = None
-            for f in formats:
-                if f.get("url") and (f.get("ext") == "mp4"):
-                    best = f
-            if not best and formats:
-                best = formats[-1]
-            if best:
-                download_url = best.get("url")
+        or info.get("url")
+        # Choose the last (best) mp4 if possible otherwise the last format
+        or next((f["url"] for f in reversed(formats) if f.get("ext") == "mp4" and f.get("url")), None)
+        or (formats[-1].get("url") if formats else None)
+    )
 
     if not download_url:
-        raise HTTPException(status_code=404, detail="Could not determine a direct media URL")
+        raise PermanentResolveError(status_code=404, detail="Could not determine a direct media URL")
 
     return {
         "title": title,
@@ -159,9 +498,82 @@ def resolve_generic(payload: ResolveRequest):
     }
 
 
+async def _resolve_addresses(host: str, port: int) -> List[str]:
+    infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    return [info[4][0] for info in infos]
+
+
+async def _check_proxy_target(url: httpx.URL) -> None:
+    """Reject proxy targets outside the allowlist or resolving to non-public addresses."""
+    if url.scheme not in ("http", "https"):
+        raise HTTPException(status_code=400, detail="Unsupported URL scheme")
+    host = url.host
+    if not any(host == h or host.endswith(f".{h}") for h in PROXY_ALLOWED_HOSTS):
+        raise HTTPException(status_code=403, detail="Host not allowed")
+    try:
+        addresses = await _resolve_addresses(host, url.port or (443 if url.scheme == "https" else 80))
+    except socket.gaierror:
+        raise HTTPException(status_code=502, detail="Could not resolve host")
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split("%", 1)[0])
+        if not ip.is_global or ip.is_multicast:
+            raise HTTPException(status_code=403, detail="Host not allowed")
+
+
+@app.get("/api/proxy")
+async def proxy(url: HttpUrl, request: Request):
+    """
+    Stream remote media (e.g. a resolved download_url) through the backend.
+    Bytes are relayed as they arrive instead of buffering the whole file.
+    """
+    headers = {k: request.headers[k] for k in PROXY_REQUEST_HEADERS if k in request.headers}
+    target = httpx.URL(str(url))
+    for _ in range(PROXY_MAX_REDIRECTS + 1):
+        await _check_proxy_target(target)
+        upstream_request = app.state.proxy_http.build_request("GET", target, headers=headers)
+        try:
+            upstream = await app.state.proxy_http.send(upstream_request, stream=True)
+        except httpx.HTTPError as e:
+            raise HTTPException(status_code=502, detail=f"Proxy network error: {e}")
+        if not upstream.is_redirect:
+            break
+        await upstream.aclose()
+        target = upstream.url.join(upstream.headers["location"])
+    else:
+        raise HTTPException(status_code=502, detail="Too many redirects")
+
+    if upstream.status_code >= 400:
+        await upstream.aclose()
+        raise HTTPException(status_code=upstream.status_code, detail="Upstream error")
+
+    return StreamingResponse(
+        upstream.aiter_raw(PROXY_CHUNK_SIZE),
+        status_code=upstream.status_code,
+        headers={k: upstream.headers[k] for k in PROXY_RESPONSE_HEADERS if k in upstream.headers},
+        background=BackgroundTask(upstream.aclose),
+    )
+
+
+_test_cache: Optional[Tuple[float, Dict[str, Any]]] = None
+_test_lock = asyncio.Lock()
+
+
 @app.get("/test")
-def test_database():
+async def test_database():
     """Test endpoint to check if database is available and accessible"""
+    global _test_cache
+    if _test_cache is not None and _test_cache[0] > time.monotonic():
+        return _test_cache[1]
+    async with _test_lock:
+        # Another request may have refreshed the entry while we waited.
+        if _test_cache is not None and _test_cache[0] > time.monotonic():
+            return _test_cache[1]
+        response = await _database_status()
+        _test_cache = (time.monotonic() + TEST_CACHE_TTL, response)
+    return response
+
+
+async def _database_status() -> Dict[str, Any]:
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -171,33 +583,28 @@ def test_database():
         "collections": []
     }
     
-    try:
-        # Try to import database module
-        from database import db
+    db = app.state.db
+    if app.state.db_error is not None:
+        response["database"] = f"❌ Error: {str(app.state.db_error)[:50]}"
+    elif db is not None:
+        response["database"] = "✅ Available"
+        response["database_url"] = "✅ Configured"
+        response["database_name"] = db.name if hasattr(db, 'name') else "✅ Connected"
+        response["connection_status"] = "Connected"
         
-        if db is not None:
-            response["database"] = "✅ Available"
-            response["database_url"] = "✅ Configured"
-            response["database_name"] = db.name if hasattr(db, 'name') else "✅ Connected"
-            response["connection_status"] = "Connected"
-            
-            # Try to list collections to verify connectivity
-            try:
-                collections = db.list_collection_names()
-                response["collections"] = collections[:10]  # Show first 10 collections
-                response["database"] = "✅ Connected & Working"
-            except Exception as e:
-                response["database"] = f"⚠️  Connected but Error: {str(e)[:50]}"
-        else:
-            response["database"] = "⚠️  Available but not initialized"
-            
-    except ImportError:
-        response["database"] = "❌ Database module not found (run enable-database first)"
-    except Exception as e:
-        response["database"] = f"❌ Error: {str(e)[:50]}"
+        # Try to list collections to verify connectivity
+        try:
+            collections = await db.list_collection_names()
+            response["collections"] = collections[:10]  # Show first 10 collections
+            response["database"] = "✅ Connected & Working"
+        except ServerSelectionTimeoutError as e:
+            response["database"] = f"⚠️  Connected but Server Unreachable: {str(e)[:50]}"
+        except Exception as e:
+            response["database"] = f"⚠️  Connected but Error: {str(e)[:50]}"
+    else:
+        response["database"] = "⚠️  Available but not initialized"
     
     # Check environment variables
-    import os
     response["database_url"] = "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set"
     response["database_name"] = "✅ Set" if os.getenv("DATABASE_NAME") else "❌ Not Set"
     
@@ -207,4 +614,15 @@ def test_database():
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # Workers need an import string rather than the app object. For container
+    # deployments the equivalent is:
+    #   gunicorn -k uvicorn.workers.UvicornWorker -w $WEB_CONCURRENCY main:app
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=port,
+        workers=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)),
+        loop="uvloop",
+        http="httptools",
+        access_log=False,
+    )
@@ -0,0 +1,200 @@
+import asyncio
+import hashlib
+import time
+
+import fakeredis.aioredis
+import httpx
+import pytest
+from fastapi import HTTPException
+
+import main
+
+
+def _key(prefix: str, url: str) -> str:
+    return f"{prefix}:{hashlib.sha1(url.encode()).hexdigest()}"
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    client = fakeredis.aioredis.FakeRedis()
+    monkeypatch.setattr(main.app.state, "redis", client, raising=False)
+    monkeypatch.setattr(main, "INFLIGHT_POLL_INTERVAL", 0.01)
+    main._inflight.clear()
+    return client
+
+
+def _counting_resolver(result=None, error=None, delay=0.05):
+    calls = []
+
+    async def resolver(url):
+        calls.append(url)
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        return result
+
+    return resolver, calls
+
+
+def test_concurrent_callers_share_one_resolver_call(redis):
+    resolver, calls = _counting_resolver(result={"download_url": "v"})
+
+    async def run():
+        return await asyncio.gather(*[main._cached_resolve("t", "u", 5, resolver) for _ in range(20)])
+
+    results = asyncio.run(run())
+    assert len(calls) == 1
+    assert all(r == {"download_url": "v"} for r in results)
+
+
+def test_concurrent_callers_share_one_call_without_redis(monkeypatch):
+    monkeypatch.setattr(main.app.state, "redis", None, raising=False)
+    main._inflight.clear()
+    resolver, calls = _counting_resolver(result={"download_url": "v"})
+
+    async def run():
+        return await asyncio.gather(*[main._cached_resolve("t", "u", 5, resolver) for _ in range(5)])
+
+    asyncio.run(run())
+    assert len(calls) == 1
+
+
+def test_error_is_shared_with_waiters(redis):
+    resolver, calls = _counting_resolver(error=HTTPException(status_code=502, detail="down"))
+
+    async def run():
+        return await asyncio.gather(
+            *[main._cached_resolve("t", "u", 5, resolver) for _ in range(5)],
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(run())
+    assert len(calls) == 1
+    assert all(isinstance(r, HTTPException) and r.status_code == 502 for r in results)
+    assert not main._inflight
+
+
+@pytest.mark.parametrize("status", [400, 404])
+def test_permanent_errors_are_cached(redis, status):
+    resolver, calls = _counting_resolver(error=main.PermanentResolveError(status_code=status, detail="nope"))
+
+    async def run():
+        for _ in range(2):
+            with pytest.raises(HTTPException) as exc:
+                await main._cached_resolve("t", "u", 5, resolver)
+            assert exc.value.status_code == status
+            assert exc.value.detail == "nope"
+
+    asyncio.run(run())
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize("status", [400, 404, 502])
+def test_other_errors_are_not_cached(redis, status):
+    resolver, calls = _counting_resolver(error=HTTPException(status_code=status, detail="down"))
+
+    async def run():
+        for _ in range(2):
+            with pytest.raises(HTTPException):
+                await main._cached_resolve("t", "u", 5, resolver)
+
+    asyncio.run(run())
+    assert len(calls) == 2
+
+
+def test_waiter_stops_once_lock_is_released(redis):
+    resolver, calls = _counting_resolver(result={"download_url": "v"}, delay=0)
+    lock_key = _key("t", "u") + ":lock"
+
+    async def run():
+        # Another worker holds the lock and then fails without caching a result.
+        await redis.set(lock_key, "other", ex=main.INFLIGHT_LOCK_TTL)
+
+        async def release():
+            await asyncio.sleep(0.1)
+            await redis.delete(lock_key)
+
+        started = time.monotonic()
+        result, _ = await asyncio.gather(main._cached_resolve("t", "u", 5, resolver), release())
+        return result, time.monotonic() - started
+
+    result, elapsed = asyncio.run(run())
+    assert result == {"download_url": "v"}
+    assert len(calls) == 1
+    assert elapsed < 1
+
+
+def test_waiter_uses_result_written_by_lock_holder(redis):
+    resolver, calls = _counting_resolver(result={"download_url": "mine"}, delay=0)
+    key = _key("t", "u")
+
+    async def run():
+        await redis.set(key + ":lock", "other", ex=main.INFLIGHT_LOCK_TTL)
+
+        async def finish():
+            await asyncio.sleep(0.1)
+            await main._cache_set(key, {"result": {"download_url": "theirs"}}, 5)
+            await redis.delete(key + ":lock")
+
+        result, _ = await asyncio.gather(main._cached_resolve("t", "u", 5, resolver), finish())
+        return result
+
+    assert asyncio.run(run()) == {"download_url": "theirs"}
+    assert not calls
+
+
+def test_lock_taken_by_another_worker_is_not_released(redis):
+    lock_key = _key("t", "u") + ":lock"
+
+    async def resolver(url):
+        # Simulate our lock expiring and another worker taking it meanwhile.
+        await redis.set(lock_key, "other")
+        return {"download_url": "v"}
+
+    async def run():
+        await main._cached_resolve("t", "u", 5, resolver)
+        return await redis.get(lock_key)
+
+    assert asyncio.run(run()) == b"other"
+
+
+def test_tikwm_rate_limit_is_not_cached(redis, monkeypatch):
+    calls = []
+
+    def tikwm(request):
+        calls.append(request)
+        return httpx.Response(200, json={"code": -1, "msg": "Free Api Limit: 1 request/second."})
+
+    monkeypatch.setattr(main.app.state, "http", httpx.AsyncClient(transport=httpx.MockTransport(tikwm)), raising=False)
+
+    async def run():
+        for _ in range(2):
+            with pytest.raises(HTTPException) as exc:
+                await main._cached_resolve("tt", "https://www.tiktok.com/@a/video/1", 5, main._resolve_tiktok)
+            assert exc.value.status_code == 400
+            assert exc.value.detail.startswith("Free Api Limit")
+        # Nothing cached and the in-flight lock was released.
+        assert await redis.keys("*") == []
+        await main.app.state.http.aclose()
+
+    asyncio.run(run())
+    assert len(calls) == 2
+
+
+def test_cancelling_first_caller_does_not_cancel_waiters(redis):
+    resolver, calls = _counting_resolver(result={"download_url": "v"}, delay=0.1)
+
+    async def run():
+        leader = asyncio.create_task(main._cached_resolve("t", "u", 5, resolver))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(main._cached_resolve("t", "u", 5, resolver))
+        await asyncio.sleep(0.02)
+        leader.cancel()
+        result = await waiter
+        return leader.cancelled(), result
+
+    leader_cancelled, result = asyncio.run(run())
+    assert leader_cancelled
+    assert result == {"download_url": "v"}
+    assert len(calls) == 1
+    assert not main._inflight
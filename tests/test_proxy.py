@@ -0,0 +1,87 @@
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+ADDRESSES = {
+    "v16.tiktokcdn.com": ["93.184.216.34"],
+    "r.tikwm.com": ["93.184.216.35"],
+    "internal.tiktokcdn.com": ["10.0.0.5"],
+    "meta.tiktokcdn.com": ["169.254.169.254"],
+}
+
+
+class _Body(httpx.AsyncByteStream):
+    def __init__(self, data: bytes):
+        self.data = data
+
+    async def __aiter__(self):
+        yield self.data
+
+
+def _upstream(request: httpx.Request) -> httpx.Response:
+    if request.url.host == "r.tikwm.com":
+        location = request.url.params.get("to") or str(request.url)
+        return httpx.Response(302, headers={"location": location})
+    return httpx.Response(200, stream=_Body(b"video"), headers={"content-type": "video/mp4"})
+
+
+@pytest.fixture
+def client(monkeypatch):
+    async def resolve(host, port):
+        return ADDRESSES[host]
+
+    async def no_warmup(client):
+        pass
+
+    monkeypatch.setattr(main, "_resolve_addresses", resolve)
+    monkeypatch.setattr(main, "_warm_tikwm", no_warmup)
+    with TestClient(main.app) as c:
+        # Swap in the mock transport, closing the client lifespan created.
+        c.portal.call(main.app.state.proxy_http.aclose)
+        main.app.state.proxy_http = httpx.AsyncClient(transport=httpx.MockTransport(_upstream))
+        yield c
+
+
+def _get(client, url):
+    return client.get("/api/proxy", params={"url": url})
+
+
+def test_streams_allowed_host(client):
+    r = _get(client, "https://v16.tiktokcdn.com/a.mp4")
+    assert r.status_code == 200
+    assert r.content == b"video"
+    assert r.headers["content-type"] == "video/mp4"
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "http://127.0.0.1:1/",
+        "http://169.254.169.254/latest/meta-data/",
+        "https://example.com/a.mp4",
+        "https://tiktokcdn.com.evil.example/a.mp4",
+    ],
+)
+def test_rejects_hosts_outside_allowlist(client, url):
+    assert _get(client, url).status_code == 403
+
+
+@pytest.mark.parametrize("host", ["internal.tiktokcdn.com", "meta.tiktokcdn.com"])
+def test_rejects_allowlisted_host_resolving_to_private_address(client, host):
+    assert _get(client, f"https://{host}/a.mp4").status_code == 403
+
+
+def test_follows_redirect_to_allowed_host(client):
+    r = _get(client, "https://r.tikwm.com/?to=https://v16.tiktokcdn.com/b.mp4")
+    assert r.status_code == 200
+    assert r.content == b"video"
+
+
+def test_rejects_redirect_to_internal_address(client):
+    assert _get(client, "https://r.tikwm.com/?to=http://127.0.0.1/").status_code == 403
+
+
+def test_stops_after_too_many_redirects(client):
+    assert _get(client, "https://r.tikwm.com/loop").status_code == 502
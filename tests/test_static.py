@@ -0,0 +1,45 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+
+@pytest.fixture
+def client(monkeypatch):
+    async def no_warmup(client):
+        pass
+
+    monkeypatch.setattr(main, "_warm_tikwm", no_warmup)
+    with TestClient(main.app) as c:
+        yield c
+
+
+def test_root_returns_body_with_etag(client):
+    r = client.get("/")
+    assert r.status_code == 200
+    assert r.json() == {"message": "Hello from FastAPI Backend!"}
+    assert r.headers["etag"] == main._ROOT_ETAG
+
+
+@pytest.mark.parametrize(
+    "if_none_match",
+    [
+        main._HELLO_ETAG,
+        f"W/{main._HELLO_ETAG}",
+        f'"other", {main._HELLO_ETAG}',
+        f'W/"other" ,W/{main._HELLO_ETAG}',
+        "*",
+    ],
+)
+def test_matching_if_none_match_returns_304(client, if_none_match):
+    r = client.get("/api/hello", headers={"If-None-Match": if_none_match})
+    assert r.status_code == 304
+    assert r.content == b""
+    assert r.headers["etag"] == main._HELLO_ETAG
+
+
+@pytest.mark.parametrize("if_none_match", ['"other"', 'W/"other", "another"', ""])
+def test_non_matching_if_none_match_returns_body(client, if_none_match):
+    r = client.get("/api/hello", headers={"If-None-Match": if_none_match})
+    assert r.status_code == 200
+    assert r.json() == {"message": "Hello from the backend API!"}